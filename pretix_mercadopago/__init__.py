@@ -4,7 +4,7 @@ from django.utils.translation import gettext_lazy
 try:
     from pretix.base.plugins import PluginConfig
 except ImportError:
-    raise RuntimeError("Please use pretix 2.7 or above to run this plugin!")
+    raise RuntimeError("Please use pretix 4.0 or above to run this plugin!")
 
 __version__ = '1.0.0'
 
@@ -20,7 +20,7 @@ class PluginMercadoPago(PluginConfig):
         visible = True
         version = __version__
         category = 'PAYMENT'
-        compatibility = "pretix>=2.7.0"
+        compatibility = "pretix>=4.0.0"
 
     def ready(self):
         from . import signals  # NOQA
@@ -0,0 +1,20 @@
+from rest_framework import viewsets
+from rest_framework.response import Response
+
+from .stats import payment_stats
+
+
+class PaymentStatsViewSet(viewsets.ViewSet):
+    permission = 'can_view_orders'
+
+    def list(self, request, *args, **kwargs):
+        stats = payment_stats(request.event)
+        return Response({
+            'computed': stats['computed'],
+            'states': [
+                {'state': row['state'], 'count': row['count'], 'amount': str(row['amount'])}
+                for row in stats['states']
+            ],
+            'pending_age': stats['pending_age'],
+            'webhook_backlog': stats['webhook_backlog'],
+        })
@@ -0,0 +1,67 @@
+from collections import namedtuple
+from typing import List
+
+from django.core.cache import cache
+
+from .ratelimit import credential_key
+
+# Seconds an account is skipped for new payments after MercadoPago failed us.
+UNHEALTHY_TIMEOUT = 60
+
+
+class Account(namedtuple('Account', ('client_id', 'secret'))):
+    """
+    One set of MercadoPago credentials. ``secret`` is empty for accounts
+    that authenticate with an access token only.
+    """
+
+    @property
+    def key(self) -> str:
+        return credential_key(self.client_id)
+
+
+def parse_pool(value: str) -> List[Account]:
+    """
+    Parses a credential pool with one account per line, given either as
+    ``<client_id> <secret>`` or as an access token on its own.
+    """
+    accounts = []
+    for line in (value or '').splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) > 2:
+            raise ValueError(line)
+        accounts.append(Account(parts[0], parts[1] if len(parts) == 2 else ''))
+    return accounts
+
+
+def format_pool(accounts: List[Account]) -> str:
+    return '\n'.join(' '.join(filter(None, account)) for account in accounts)
+
+
+def is_healthy(account: Account) -> bool:
+    return not cache.get('mercadopago:unhealthy:{}'.format(account.key))
+
+
+def mark_unhealthy(account: Account):
+    cache.set('mercadopago:unhealthy:{}'.format(account.key), True, UNHEALTHY_TIMEOUT)
+
+
+def round_robin(accounts: List[Account], key: str) -> List[Account]:
+    """
+    Returns the healthy accounts, rotated by one position on every call
+    across all workers sharing the cache. If no account is healthy, all
+    of them are returned so payments are still attempted.
+    """
+    healthy = [a for a in accounts if is_healthy(a)] or list(accounts)
+    if len(healthy) < 2:
+        return healthy
+    counter_key = 'mercadopago:roundrobin:{}'.format(key)
+    cache.add(counter_key, 0, timeout=None)
+    try:
+        offset = cache.incr(counter_key)
+    except ValueError:
+        offset = 0
+    offset %= len(healthy)
+    return healthy[offset:] + healthy[:offset]
@@ -0,0 +1,74 @@
+from django import forms
+from django.utils.translation import gettext_lazy as _
+
+from .credentials import format_pool, parse_pool
+from .payment import (
+    DEFAULT_API_RATE_LIMIT, DEFAULT_API_RATE_LIMIT_WAIT, MAX_API_RATE_LIMIT_WAIT,
+)
+
+
+class OrganizerSettingsForm(forms.Form):
+    # Credentials already in the pool are never sent back to the browser,
+    # they can only be added or removed.
+    add_accounts = forms.CharField(
+        label=_('Add MercadoPago accounts'),
+        widget=forms.Textarea(attrs={'rows': 4, 'autocomplete': 'off'}),
+        required=False,
+        help_text=_('One account per line, given as client ID and secret separated by a space, or as an '
+                    'access token on its own. New payments of all events of this organizer are spread '
+                    'over these accounts instead of using the credentials set up for the event.'),
+    )
+    remove_accounts = forms.MultipleChoiceField(
+        label=_('Remove MercadoPago accounts'),
+        widget=forms.CheckboxSelectMultiple,
+        required=False,
+    )
+    api_rate_limit = forms.IntegerField(
+        label=_('API rate limit'),
+        required=True,
+        min_value=0,
+        help_text=_('Maximum number of payments per second sent to MercadoPago with each account, '
+                    'shared by all events of this organizer. Use "0" for no limit.'),
+    )
+    api_rate_limit_wait = forms.IntegerField(
+        label=_('API rate limit waiting time'),
+        required=True,
+        min_value=0,
+        max_value=MAX_API_RATE_LIMIT_WAIT,
+        help_text=_('Seconds a customer may wait for a free slot before being asked to try again.'),
+    )
+
+    def __init__(self, *args, organizer, **kwargs):
+        self.organizer = organizer
+        self.accounts = parse_pool(organizer.settings.get('payment_mercadopago_credential_pool'))
+        kwargs['initial'] = {
+            'api_rate_limit': organizer.settings.get('payment_mercadopago_api_rate_limit', as_type=int,
+                                                     default=DEFAULT_API_RATE_LIMIT),
+            'api_rate_limit_wait': organizer.settings.get('payment_mercadopago_api_rate_limit_wait', as_type=int,
+                                                          default=DEFAULT_API_RATE_LIMIT_WAIT),
+        }
+        super().__init__(*args, **kwargs)
+        if self.accounts:
+            self.fields['remove_accounts'].choices = [(a.key, a.key) for a in self.accounts]
+        else:
+            del self.fields['remove_accounts']
+
+    def clean_add_accounts(self):
+        try:
+            return parse_pool(self.cleaned_data['add_accounts'])
+        except ValueError:
+            raise forms.ValidationError(_('Please enter one account per line, as client ID and secret '
+                                          'separated by a space, or as an access token on its own.'))
+
+    def save(self):
+        removed = set(self.cleaned_data.get('remove_accounts') or [])
+        accounts = [a for a in self.accounts if a.key not in removed]
+        for account in self.cleaned_data['add_accounts']:
+            if account.key not in {a.key for a in accounts}:
+                accounts.append(account)
+
+        settings = self.organizer.settings
+        settings.set('payment_mercadopago_credential_pool', format_pool(accounts))
+        settings.set('payment_mercadopago_api_rate_limit', self.cleaned_data['api_rate_limit'])
+        settings.set('payment_mercadopago_api_rate_limit_wait', self.cleaned_data['api_rate_limit_wait'])
+        self.accounts = accounts
@@ -0,0 +1,117 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django_scopes import scopes_disabled
+
+from pretix_mercadopago.models import WebhookEvent
+from pretix_mercadopago.payment import Mercadopago
+from pretix_mercadopago.views import parse_notification, process_notification
+
+# Seconds a replayed notification may wait for the account's rate limit.
+RATE_LIMIT_WAIT = 60
+
+
+class Command(BaseCommand):
+    help = "Replay journaled MercadoPago notifications through the payment processing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Only replay notifications received at or after this ISO datetime')
+        parser.add_argument('--until', type=str, help='Only replay notifications received before this ISO datetime')
+        parser.add_argument('--event', type=str, help='Only replay notifications of the event with this slug')
+        parser.add_argument('--unprocessed', action='store_true',
+                            help='Only replay notifications that have not been processed successfully')
+        parser.add_argument('--speed', type=float, default=10,
+                            help='Replay this many times faster than received. Use "0" to replay without pauses.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the notifications that would be replayed, without contacting '
+                                 'MercadoPago or changing any payment')
+
+    def _parse(self, value):
+        if not value:
+            return None
+        dt = parse_datetime(value)
+        if dt is None:
+            raise CommandError('Invalid datetime: {}'.format(value))
+        return dt
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('Speed must not be negative.')
+
+        qs = WebhookEvent.objects.select_related('event')
+        since, until = self._parse(options['since']), self._parse(options['until'])
+        if since:
+            qs = qs.filter(received__gte=since)
+        if until:
+            qs = qs.filter(received__lt=until)
+        if options['event']:
+            qs = qs.filter(event__slug=options['event'])
+        if options['unprocessed']:
+            qs = qs.filter(processed__isnull=True)
+
+        replayed = ignored = failed = 0
+        busy = 0.0
+        previous = None
+        providers = {}
+        for notification in qs.order_by('received', 'pk').iterator():
+            params = json.loads(notification.query)
+            mp_payment_id = parse_notification(params, notification.body)
+
+            if notification.event is None or mp_payment_id is None:
+                ignored += 1
+                continue
+            if options['dry_run']:
+                self.stdout.write('{} {} {} payment {}'.format(
+                    notification.pk, notification.received.isoformat(), notification.event.slug, mp_payment_id
+                ))
+                replayed += 1
+                continue
+
+            if previous and options['speed']:
+                time.sleep(max(0, (notification.received - previous).total_seconds() / options['speed']))
+            previous = notification.received
+
+            if notification.event_id not in providers:
+                providers[notification.event_id] = Mercadopago(notification.event)
+            provider = providers[notification.event_id]
+            # Stay within the same limits as the live checkout
+            limiter = provider.get_rate_limiter(provider.get_account(params.get('account')))
+
+            if not limiter.acquire(timeout=RATE_LIMIT_WAIT):
+                self.stderr.write('Notification {} skipped, MercadoPago rate limit reached'.format(notification.pk))
+                failed += 1
+                continue
+
+            start = time.monotonic()
+            try:
+                payment = process_notification(
+                    notification.event,
+                    mp_payment_id,
+                    params.get('collection_status'),
+                    account_key=params.get('account'),
+                )
+            except Exception as e:
+                self.stderr.write('Notification {} could not be processed: {}'.format(notification.pk, e))
+                failed += 1
+                continue
+            finally:
+                busy += time.monotonic() - start
+
+            if payment is None:
+                self.stderr.write('Notification {} rejected, MercadoPago does not confirm it'.format(notification.pk))
+                notification.record_outcome(WebhookEvent.OUTCOME_REJECTED)
+                failed += 1
+            else:
+                notification.record_outcome(WebhookEvent.OUTCOME_PROCESSED)
+                replayed += 1
+
+        if options['dry_run']:
+            self.stdout.write('Would replay {} notifications, {} ignored.'.format(replayed, ignored))
+            return
+        total = replayed + failed
+        self.stdout.write('Replayed {} notifications, {} failed, {} ignored, {:.1f} ms average processing time.'.format(
+            total, failed, ignored, busy * 1000 / total if total else 0
+        ))
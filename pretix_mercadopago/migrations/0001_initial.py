@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('pretixbase', '0036_auto_20160902_0755'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('method', models.CharField(max_length=8)),
+                ('query', models.TextField()),
+                ('body', models.TextField(blank=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                            related_name='mercadopago_webhooks', to='pretixbase.Event')),
+            ],
+            options={
+                'ordering': ('received', 'pk'),
+            },
+        ),
+    ]
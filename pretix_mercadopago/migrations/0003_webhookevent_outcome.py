@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretix_mercadopago', '0002_webhookevent_backlog_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='outcome',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import models
+from django.utils.timezone import now
+
+
+class WebhookEvent(models.Model):
+    # Append-only journal of every notification MercadoPago sent us, kept
+    # verbatim so it can be replayed with `manage.py mercadopago_replay_webhooks`.
+    # ``processed`` is set once the notification has been dealt with, and
+    # ``outcome`` tells how.
+    OUTCOME_PROCESSED = 'processed'
+    OUTCOME_IGNORED = 'ignored'
+    OUTCOME_REJECTED = 'rejected'
+
+    event = models.ForeignKey('pretixbase.Event', null=True, on_delete=models.CASCADE,
+                              related_name='mercadopago_webhooks')
+    received = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=8)
+    query = models.TextField()
+    body = models.TextField(blank=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=16, blank=True)
+
+    class Meta:
+        ordering = ('received', 'pk')
+        indexes = [
+            models.Index(fields=['event', 'processed'], name='mercadopago_webhook_backlog'),
+        ]
+
+    def record_outcome(self, outcome):
+        WebhookEvent.objects.filter(pk=self.pk).update(processed=now(), outcome=outcome)
@@ -1,7 +1,10 @@
 import logging
 import json
 from collections import OrderedDict
+from datetime import timedelta
 from decimal import Decimal
+from typing import List, Optional
+from urllib.parse import urlencode
 
 import mercadopago 
 
@@ -10,6 +13,8 @@ from django.contrib import messages
 from django.http import HttpRequest
 from django.template.loader import get_template
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
 from django.utils.translation import gettext as __, gettext_lazy as _
 from i18nfield.strings import LazyI18nString
 
@@ -19,6 +24,9 @@ from pretix.base.settings import SettingsSandbox
 from pretix.helpers.urls import build_absolute_uri as build_global_uri
 from pretix.multidomain.urlreverse import build_absolute_uri
 
+from .credentials import Account, mark_unhealthy, parse_pool, round_robin
+from .ratelimit import WindowRateLimiter
+
 logger = logging.getLogger('pretix.plugins.mercadopago')
 
 SUPPORTED_CURRENCIES = ['ARS', 'BRL', 'CLP', 'MXN', 'COP', 'PEN', 'UYU']
@@ -32,6 +40,17 @@ SUPPORTED_CURRENCIES = ['ARS', 'BRL', 'CLP', 'MXN', 'COP', 'PEN', 'UYU']
 
 LOCAL_ONLY_CURRENCIES = ['ARS']
 
+# Minutes a MercadoPago checkout link stays valid unless configured otherwise.
+DEFAULT_PREFERENCE_EXPIRATION = 60
+
+# Calls per second to the MercadoPago API per set of credentials, and
+# seconds a checkout may wait for a free slot before asking to retry.
+# Both are organizer settings, as credentials are shared between events.
+# The wait blocks a web worker, so it is kept short.
+DEFAULT_API_RATE_LIMIT = 10
+DEFAULT_API_RATE_LIMIT_WAIT = 3
+MAX_API_RATE_LIMIT_WAIT = 10
+
 
 class Mercadopago(BasePaymentProvider):
     identifier = 'pretix_mercadopago'
@@ -127,6 +146,16 @@ class Mercadopago(BasePaymentProvider):
                     help_text=_('Exchange rate to apply to the event currency. Use "1" to not apply any exchange rate.')
                     )
                 ),
+            ('preference_expiration',
+                forms.IntegerField(
+                    label=_('Payment link expiration'),
+                    required=True,
+                    initial=DEFAULT_PREFERENCE_EXPIRATION,
+                    min_value=5,
+                    help_text=_('Minutes the customer has to start the payment on MercadoPago. '
+                                'Unused payment attempts are cancelled afterwards.')
+                    )
+                ),
         ]
 
         d = OrderedDict(
@@ -167,11 +196,74 @@ class Mercadopago(BasePaymentProvider):
 
         return settings_content
 
-    def init_api(self) -> mercadopago.MP:
-        if self.settings.get('client_id') and not self.settings.get('secret'):
-            mp = mercadopago.MP(self.settings.get('client_id'))
+    @property
+    def preference_expiration(self) -> int:
+        return self.settings.get('preference_expiration', as_type=int, default=DEFAULT_PREFERENCE_EXPIRATION)
+
+    @property
+    def accounts(self) -> List[Account]:
+        # The organizer's credential pool takes precedence over the
+        # credentials configured for the event.
+        try:
+            pool = parse_pool(self.settings.get('credential_pool'))
+        except ValueError:
+            logger.error('Invalid MercadoPago credential pool for event %s', self.event.slug)
+            pool = []
+        return pool or [self.event_account]
+
+    @property
+    def event_account(self) -> Account:
+        return Account(self.settings.get('client_id'), self.settings.get('secret') or '')
+
+    def candidate_accounts(self, key: str = None) -> List[Account]:
+        # The accounts a payment may have been made with. Payments made
+        # before the pool was set up carry no key and belong to the event's
+        # own credentials, so those come first.
+        known = [self.event_account] + [a for a in self.accounts if a.key != self.event_account.key]
+        for account in known:
+            if account.key == key:
+                return [account]
+        return known
+
+    def get_account(self, key: str = None) -> Account:
+        return self.candidate_accounts(key)[0]
+
+    def select_account(self) -> Optional[Account]:
+        # Balances new payments over the healthy accounts, skipping those
+        # that are at their rate limit. Only if all of them are, we wait a
+        # bit for the first one. Returns None if it stays busy.
+        candidates = round_robin(self.accounts, str(self.event.organizer_id))
+        for account in candidates:
+            if self.get_rate_limiter(account).try_acquire():
+                return account
+        wait = self.event.organizer.settings.get('payment_mercadopago_api_rate_limit_wait', as_type=int,
+                                                 default=DEFAULT_API_RATE_LIMIT_WAIT)
+        if self.get_rate_limiter(candidates[0]).acquire(timeout=min(wait, MAX_API_RATE_LIMIT_WAIT)):
+            return candidates[0]
+        return None
+
+    def preference_expiry(self, payment: OrderPayment):
+        # When the checkout link of the payment's latest preference stops
+        # working. Payments without one are treated as if the link was
+        # created with the payment.
+        expiration_date_to = payment.info_data.get('expiration_date_to')
+        if expiration_date_to:
+            return parse_datetime(expiration_date_to)
+        return payment.created + timedelta(minutes=self.preference_expiration)
+
+    def get_rate_limiter(self, account: Account) -> WindowRateLimiter:
+        return WindowRateLimiter(
+            account.key,
+            self.event.organizer.settings.get('payment_mercadopago_api_rate_limit', as_type=int,
+                                              default=DEFAULT_API_RATE_LIMIT)
+        )
+
+    def init_api(self, account: Account = None) -> mercadopago.MP:
+        account = account or self.get_account()
+        if account.client_id and not account.secret:
+            mp = mercadopago.MP(account.client_id)
         else:
-            mp = mercadopago.MP(self.settings.get('client_id'), self.settings.get('secret'))
+            mp = mercadopago.MP(account.client_id, account.secret)
         return mp
 
     ####################################################################
@@ -190,10 +282,23 @@ class Mercadopago(BasePaymentProvider):
         return True
 
     def execute_payment(self, request: HttpRequest, payment_obj: OrderPayment):
+        # Keep the number of preferences we create within MercadoPago's limits.
+        # The payment stays open, so the customer can simply try again.
+        try:
+            account = self.select_account()
+        except Exception as e:
+            messages.error(request, _('We had trouble preparing the order for ' +
+            'MercadoPago ' + str(e)))
+            logger.exception('Error on selecting a MercadoPago account: ' + str(e))
+            return
+        if account is None:
+            raise PaymentException(_('MercadoPago is receiving too many payments right now. '
+                                     'Please try again in a few seconds.'))
+
         try:
             # After the user has confirmed their purchase,
             # this method will be called to complete the payment process.
-            mp = self.init_api()
+            mp = self.init_api(account)
             order = payment_obj.order
             meta_info = json.loads(order.meta_info)
             form_data = meta_info.get('contact_form_data', {})
@@ -223,6 +328,10 @@ class Mercadopago(BasePaymentProvider):
                 price = price * float(self.settings.get('exchange_rate'))
             price = round(price, 2)
 
+            # The link is valid right away; only its end is set, so a clock
+            # running ahead of MercadoPago's can't make it unusable.
+            expiration_date_to = now() + timedelta(minutes=self.preference_expiration)
+
             order_url = build_absolute_uri(request.event, 
             'presale:event.order', 
                 kwargs={
@@ -230,6 +339,9 @@ class Mercadopago(BasePaymentProvider):
                     'secret': order.secret
                 }
             )
+            # Tells views.success which account to verify the payment with
+            return_url = build_absolute_uri(request.event,
+                'plugins:pretix_mercadopago:return') + '?' + urlencode({'account': account.key})
             
             preference = {
                 "items": [
@@ -246,16 +358,10 @@ class Mercadopago(BasePaymentProvider):
                 "auto_return": 'all', 
                 "back_urls": {
                     "failure": order_url,
-                    "pending":
-                        build_absolute_uri(request.event,
-                            'plugins:pretix_mercadopago:return'),
-                    "success":
-                        build_absolute_uri(request.event,
-                            'plugins:pretix_mercadopago:return')
+                    "pending": return_url,
+                    "success": return_url
                 },
-                "notification_url": 
-                        build_absolute_uri(request.event,
-                            'plugins:pretix_mercadopago:return'),
+                "notification_url": return_url,
                 "statement_descriptor": __('Order {slug}-{code}').format(
                                         slug=self.event.slug,
                                         code=order.code),
@@ -273,7 +379,9 @@ class Mercadopago(BasePaymentProvider):
                 },
                 "payment_methods": {
                     "installments" : 1
-                }
+                },
+                "expires": True,
+                "expiration_date_to": expiration_date_to.isoformat(timespec='milliseconds')
             }
 
 
@@ -281,22 +389,28 @@ class Mercadopago(BasePaymentProvider):
             # Glossary of attributes response in https://developers.mercadopago.com
             #        paymentInfo = mp.get_payment(kwargs["id"])
 
-            preferenceResult = mp.create_preference(preference)
+            try:
+                preferenceResult = mp.create_preference(preference)
+            except Exception:
+                mark_unhealthy(account)
+                raise
+            preferenceResult['account'] = account.key
+            preferenceResult['expiration_date_to'] = expiration_date_to.isoformat()
             payment_obj.info = json.dumps(preferenceResult, indent=4)
             payment_obj.save()
-            request.session['payment_mercadopago_preferece_id'] = str(preferenceResult['response']['id'])
-            request.session['payment_mercadopago_collector_id'] = str(
-                preferenceResult['response']['collector_id'])
-            request.session['payment_mercadopago_order'] = order.pk
+            # Lets views.success lead the customer back to this order
+            # even if MercadoPago can't confirm the payment.
             request.session['payment_mercadopago_payment'] = payment_obj.pk
 
             try:
                 if preferenceResult:
                     if preferenceResult["status"] not in (200, 201): # ate not in ('created', 'approved', 'pending'):
+                        if preferenceResult["status"] != 400:
+                            # Not our fault, give this account a break
+                            mark_unhealthy(account)
                         messages.error(request, _('We had trouble communicating with MercadoPago' + str(preferenceResult["response"]["message"])))
                         logger.error('Invalid payment state: ' + str(preferenceResult["response"]))
                         return
-                    request.session['payment_mercadopago_id'] = str(preferenceResult["response"]["id"])
                     if (self.test_mode_message == None):
                         link = preferenceResult["response"]["init_point"]
                     else:
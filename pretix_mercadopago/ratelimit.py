@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import random
+import time
+
+from django.core.cache import cache
+
+from pretix.base.metrics import Counter, Histogram
+
+logger = logging.getLogger('pretix.plugins.mercadopago')
+
+mercadopago_ratelimit_wait = Histogram(
+    'pretix_mercadopago_ratelimit_wait_seconds',
+    'Time spent waiting for a free MercadoPago API slot',
+    ['account'],
+    buckets=(0, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, float('inf')),
+)
+mercadopago_ratelimit_rejected = Counter(
+    'pretix_mercadopago_ratelimit_rejected_total',
+    'Requests turned away because the MercadoPago API limit was reached',
+    ['account'],
+)
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def credential_key(client_id: str) -> str:
+    # Identifies a set of MercadoPago credentials without exposing them
+    # in cache keys, metrics or logs.
+    return hashlib.sha1((client_id or '').encode()).hexdigest()[:12]
+
+
+class WindowRateLimiter:
+    """
+    Rate limiter shared by all pretix workers through the Django cache.
+
+    It allows at most ``rate`` calls within any second. Calls are counted in
+    slots of a tenth of a second, and a call is only let through if the slots
+    of the past second hold fewer than ``rate`` calls. As a slot is only
+    forgotten once it is entirely older than a second, this is a strict
+    ceiling, at the price of sometimes waiting up to a tenth of a second too
+    long. This is only distributed if the configured cache backend (e.g. Redis)
+    is shared between processes.
+    """
+
+    SLOTS_PER_SECOND = 10
+
+    def __init__(self, key: str, rate: int):
+        self.key = key
+        self.rate = rate
+
+    def _slot_key(self, slot):
+        return 'mercadopago:ratelimit:{}:{}'.format(self.key, slot)
+
+    def _take(self):
+        # Returns whether a call may happen now, and otherwise the seconds
+        # until the oldest counted slot drops out of the window.
+        t = time.time()
+        current = int(t * self.SLOTS_PER_SECOND)
+        slots = range(current - self.SLOTS_PER_SECOND, current)
+        current_key = self._slot_key(current)
+
+        # Count ourselves first, so concurrent callers see each other
+        cache.add(current_key, 0, timeout=5)
+        try:
+            used = cache.incr(current_key)
+        except ValueError:
+            # The key has been evicted in the meantime, so the slot is fresh.
+            cache.set(current_key, 1, timeout=5)
+            used = 1
+        counts = cache.get_many([self._slot_key(s) for s in slots])
+        if used + sum(counts.values()) <= self.rate:
+            return True, 0
+
+        try:
+            cache.decr(current_key)
+        except ValueError:
+            pass
+        oldest = next((s for s in slots if counts.get(self._slot_key(s))), current)
+        return False, (oldest + self.SLOTS_PER_SECOND + 1) / self.SLOTS_PER_SECOND - t
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a slot if one is free right now, without waiting.
+        """
+        if not self.rate:
+            return True
+        granted, _ = self._take()
+        if granted:
+            mercadopago_ratelimit_wait.observe(0, account=self.key)
+        return granted
+
+    def acquire(self, timeout: float) -> bool:
+        """
+        Takes a slot, waiting up to ``timeout`` seconds for one to become free.
+        Returns ``False`` if no slot became available in time.
+        """
+        if not self.rate:
+            return True
+
+        start = time.monotonic()
+        while True:
+            granted, free_in = self._take()
+            waited = time.monotonic() - start
+            if granted:
+                mercadopago_ratelimit_wait.observe(waited, account=self.key)
+                return True
+            if waited + free_in > timeout:
+                mercadopago_ratelimit_rejected.inc(1, account=self.key)
+                logger.warning('MercadoPago rate limit reached for account %s after waiting %.2fs', self.key, waited)
+                return False
+            # Spread the waiting workers over the next slot
+            time.sleep(free_in + random.uniform(0, 0.05))
@@ -1,20 +1,45 @@
 import json
+import logging
 from collections import OrderedDict
+from datetime import timedelta
 
 from django import forms
+from django.db import connections, transaction
+from django.utils.timezone import now
 from django.utils.translation import gettext as __, gettext_lazy as _
 from django.dispatch import receiver
+from django.urls import resolve, reverse
+from django_scopes import scopes_disabled
 
 from pretix.base.forms import SecretKeySettingsField
+from pretix.base.models import Event, LogEntry, OrderPayment
 from pretix.base.signals import (
-    logentry_display, register_global_settings, register_payment_providers,
-    requiredaction_display
+    logentry_display, periodic_task, register_global_settings,
+    register_payment_providers, requiredaction_display
 )
+from pretix.control.signals import nav_event, nav_organizer
+from pretix.helpers.periodic import minimum_interval
 
 from pretix.presale.signals import (
     contact_form_fields, question_form_fields 
 )
 
+logger = logging.getLogger('pretix.plugins.mercadopago')
+
+# Extra minutes we wait after a checkout link expired before cancelling
+# its payment, so late notifications from MercadoPago still arrive first.
+EXPIRATION_GRACE_PERIOD = 15
+
+# Payments cancelled per transaction, so the rows stay locked only briefly.
+EXPIRATION_BATCH_SIZE = 500
+
+# Days processed notifications are kept in the journal.
+JOURNAL_RETENTION_DAYS = 30
+
+# Days notifications that failed to process are kept for a replay. Anyone
+# can send us notifications, so these must not pile up forever either.
+UNPROCESSED_RETENTION_DAYS = 7
+
 
 @receiver(register_payment_providers, dispatch_uid="payment_mercadopago")
 def register_payment_provider(sender, **kwargs):
@@ -22,6 +47,108 @@ def register_payment_provider(sender, **kwargs):
     return Mercadopago
 
 
+@receiver(nav_event, dispatch_uid="mercadopago_nav")
+def control_nav_payments(sender, request=None, **kwargs):
+    if not request.user.has_event_permission(request.organizer, request.event, 'can_view_orders', request=request):
+        return []
+    url = resolve(request.path_info)
+    return [
+        {
+            'label': _('MercadoPago'),
+            'url': reverse('plugins:pretix_mercadopago:backend', kwargs={
+                'event': request.event.slug,
+                'organizer': request.event.organizer.slug,
+            }),
+            'active': url.namespace == 'plugins:pretix_mercadopago' and url.url_name == 'backend',
+            'icon': 'credit-card',
+        }
+    ]
+
+
+@receiver(nav_organizer, dispatch_uid="mercadopago_organav")
+def control_nav_organizer_accounts(sender, request=None, **kwargs):
+    if not request.user.has_organizer_permission(request.organizer, 'can_change_organizer_settings', request=request):
+        return []
+    url = resolve(request.path_info)
+    return [
+        {
+            'label': _('MercadoPago'),
+            'url': reverse('plugins:pretix_mercadopago:organizer.settings', kwargs={
+                'organizer': request.organizer.slug,
+            }),
+            'active': url.namespace == 'plugins:pretix_mercadopago' and url.url_name == 'organizer.settings',
+            'icon': 'credit-card',
+        }
+    ]
+
+
+@receiver(signal=periodic_task, dispatch_uid="mercadopago_expire_preferences")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=5)
+def expire_abandoned_payments(sender, **kwargs):
+    from .payment import Mercadopago
+
+    open_payments = OrderPayment.objects.filter(
+        provider=Mercadopago.identifier,
+        state=OrderPayment.PAYMENT_STATE_CREATED,
+    )
+    event_ids = open_payments.values_list('order__event_id', flat=True).distinct()
+    cutoff = now() - timedelta(minutes=EXPIRATION_GRACE_PERIOD)
+    for event in Event.objects.filter(pk__in=event_ids):
+        provider = Mercadopago(event)
+        # No link can expire earlier than this after its payment was created.
+        # A payment may have been retried with a newer link though, so the
+        # expiry of its latest link is what decides.
+        candidates = open_payments.filter(
+            order__event=event,
+            created__lt=cutoff - timedelta(minutes=provider.preference_expiration),
+        ).only('pk', 'created', 'info')
+        expired_ids = [p.pk for p in candidates.iterator() if provider.preference_expiry(p) < cutoff]
+
+        for i in range(0, len(expired_ids), EXPIRATION_BATCH_SIZE):
+            with transaction.atomic():
+                # Only cancel what no notification changed since we looked
+                payments = list(
+                    OrderPayment.objects.select_for_update().filter(
+                        pk__in=expired_ids[i:i + EXPIRATION_BATCH_SIZE],
+                        state=OrderPayment.PAYMENT_STATE_CREATED,
+                    ).select_related('order', 'order__event')
+                )
+                OrderPayment.objects.filter(pk__in=[p.pk for p in payments]).update(
+                    state=OrderPayment.PAYMENT_STATE_CANCELED
+                )
+                log_entries = [
+                    p.order.log_action('pretix.event.order.payment.canceled', {
+                        'local_id': p.local_id,
+                        'provider': p.provider,
+                    }, save=False)
+                    for p in payments
+                ]
+                if connections['default'].features.can_return_rows_from_bulk_insert:
+                    LogEntry.objects.bulk_create(log_entries)
+                else:
+                    for le in log_entries:
+                        le.save()
+            LogEntry.bulk_postprocess(log_entries)
+            if payments:
+                logger.info('Cancelled %d abandoned MercadoPago payments of event %s', len(payments), event.slug)
+
+
+@receiver(signal=periodic_task, dispatch_uid="mercadopago_prune_journal")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=60)
+def prune_webhook_journal(sender, **kwargs):
+    from .models import WebhookEvent
+
+    WebhookEvent.objects.filter(
+        processed__isnull=False,
+        received__lt=now() - timedelta(days=JOURNAL_RETENTION_DAYS),
+    ).delete()
+    WebhookEvent.objects.filter(
+        processed__isnull=True,
+        received__lt=now() - timedelta(days=UNPROCESSED_RETENTION_DAYS),
+    ).delete()
+
 
 @receiver(signal=logentry_display, dispatch_uid="mercadopago_logentry_display")
 def pretixcontrol_logentry_display(sender, logentry, **kwargs):
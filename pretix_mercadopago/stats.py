@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.db.models import Count, Min, Q, Sum
+from django.utils.timezone import now
+
+from pretix.base.models import Event, OrderPayment
+
+from .models import WebhookEvent
+from .payment import Mercadopago
+
+# Seconds the statistics of an event are served from the cache.
+STATS_CACHE_TIMEOUT = 30
+
+# Only recent unprocessed notifications count as backlog. Older ones are
+# either handled by now or will never be, and would only hide new problems.
+WEBHOOK_BACKLOG_WINDOW = timedelta(hours=24)
+
+OPEN_STATES = (OrderPayment.PAYMENT_STATE_CREATED, OrderPayment.PAYMENT_STATE_PENDING)
+
+
+def payment_stats(event: Event) -> dict:
+    """
+    Returns the MercadoPago payment statistics of an event. Everything is
+    computed with a few aggregated queries and cached for a short time, so
+    this stays cheap on events with many orders.
+    """
+    cache = event.get_cache()
+    stats = cache.get('mercadopago_payment_stats')
+    if stats is None:
+        stats = _compute_payment_stats(event)
+        cache.set('mercadopago_payment_stats', stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def _compute_payment_stats(event: Event) -> dict:
+    computed = now()
+    payments = OrderPayment.objects.filter(order__event=event, provider=Mercadopago.identifier)
+
+    states = [
+        {'state': row['state'], 'count': row['count'], 'amount': row['amount']}
+        for row in payments.order_by('state').values('state').annotate(count=Count('id'), amount=Sum('amount'))
+    ]
+
+    hour_ago = computed - timedelta(hours=1)
+    day_ago = computed - timedelta(days=1)
+    week_ago = computed - timedelta(days=7)
+    pending_age = payments.filter(state__in=OPEN_STATES).aggregate(
+        less_than_1h=Count('id', filter=Q(created__gte=hour_ago)),
+        from_1h_to_1d=Count('id', filter=Q(created__lt=hour_ago, created__gte=day_ago)),
+        from_1d_to_7d=Count('id', filter=Q(created__lt=day_ago, created__gte=week_ago)),
+        more_than_7d=Count('id', filter=Q(created__lt=week_ago)),
+    )
+
+    webhook_backlog = WebhookEvent.objects.filter(
+        event=event,
+        processed__isnull=True,
+        received__gte=computed - WEBHOOK_BACKLOG_WINDOW,
+    ).aggregate(
+        count=Count('id'),
+        oldest=Min('received'),
+    )
+
+    return {
+        'computed': computed,
+        'states': states,
+        'pending_age': pending_age,
+        'webhook_backlog': webhook_backlog,
+    }
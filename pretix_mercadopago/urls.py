@@ -1,8 +1,11 @@
 from django.conf.urls import include, url
 import pretix_mercadopago.views as views
 
+from pretix.api.urls import event_router
 from pretix.multidomain import event_url
 
+from .api import PaymentStatsViewSet
+
 from .views import (
     oauth_disconnect, redirect_view, success,
 )
@@ -20,9 +23,13 @@ event_patterns = [
 
 
 urlpatterns = [
-    url(r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/mercadopago/',
+    url(r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/mercadopago/$',
         views.admin_view, name='backend'),
     url(r'^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/mercadopago/disconnect/',
         oauth_disconnect, name='oauth.disconnect'),
+    url(r'^control/organizer/(?P<organizer>[^/]+)/mercadopago/$',
+        views.organizer_settings_view, name='organizer.settings'),
     url(r'^mercadopago/webhook/$', success, name='webhook'),
 ]
+
+event_router.register('mercadopago/stats', PaymentStatsViewSet, basename='mercadopago-stats')
@@ -1,3 +1,4 @@
+import json
 import logging
 from decimal import Decimal
 
@@ -15,20 +16,46 @@ from django.views.decorators.http import require_POST
 
 from pretix.base.models import Event, Order, OrderPayment, OrderRefund, Quota
 from pretix.base.payment import PaymentException
-from pretix.control.permissions import event_permission_required
+from pretix.control.permissions import event_permission_required, organizer_permission_required
 from pretix.multidomain.urlreverse import eventreverse
+from pretix_mercadopago.credentials import is_healthy
+from pretix_mercadopago.forms import OrganizerSettingsForm
+from pretix_mercadopago.models import WebhookEvent
 from pretix_mercadopago.payment import Mercadopago
+from pretix_mercadopago.ratelimit import RateLimitExceeded
+from pretix_mercadopago.stats import payment_stats
 
 logger = logging.getLogger('pretix.plugins.mercadopago')
 
 
+@event_permission_required('can_view_orders')
 def admin_view(request, *args, **kwargs):
+    stats = payment_stats(request.event)
+    state_labels = dict(OrderPayment.PAYMENT_STATES)
     r = render(request, 'pretix_mercadopago/admin.html', {
+        'stats': stats,
+        'states': [dict(row, label=state_labels.get(row['state'], row['state'])) for row in stats['states']],
     })
     r._csp_ignore = True
     return r
 
 
+@organizer_permission_required('can_change_organizer_settings')
+def organizer_settings_view(request, *args, **kwargs):
+    form = OrganizerSettingsForm(organizer=request.organizer, data=request.POST if request.method == 'POST' else None)
+    if request.method == 'POST' and form.is_valid():
+        form.save()
+        messages.success(request, _('Your changes have been saved.'))
+        return redirect(reverse('plugins:pretix_mercadopago:organizer.settings', kwargs={
+            'organizer': request.organizer.slug,
+        }))
+
+    return render(request, 'pretix_mercadopago/organizer_settings.html', {
+        'form': form,
+        'accounts': [(account.key, is_healthy(account)) for account in form.accounts],
+    })
+
+
 @xframe_options_exempt
 def redirect_view(request, *args, **kwargs):
     signer = signing.Signer(salt='safe-redirect')
@@ -43,75 +70,195 @@ def redirect_view(request, *args, **kwargs):
     r._csp_ignore = True
     return r
 
-# Return url for MercadoPago when payment is pending or success
-@csrf_exempt
-def success(request, *args, **kwargs):
-    collection_id = request.GET.get('collection_id')
-    status = request.GET.get('collection_status')
+def _report(request, message):
+    logger.warning(message)
+    if request is not None:
+        messages.error(request, message)
+
+
+def parse_notification(query, body):
+    """
+    Returns the id of the MercadoPago payment a request to the return URL is
+    about, or ``None`` if it is about something else (e.g. a merchant order).
+    Understands the redirects of the customer's browser (``collection_id``),
+    IPN notifications (``topic=payment&id=``) and webhooks (``type=payment&data.id=``,
+    or the same as JSON body).
+    """
+    if query.get('collection_id') not in (None, '', 'null'):
+        return query['collection_id']
+    if query.get('topic') == 'payment' and query.get('id'):
+        return query['id']
+    if query.get('type') == 'payment' and query.get('data.id'):
+        return query['data.id']
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and data.get('type') == 'payment' and isinstance(data.get('data'), dict):
+        if data['data'].get('id'):
+            return str(data['data']['id'])
+    return None
 
+
+def process_notification(event, mp_payment_id, status=None, request=None, account_key=None):
+    """
+    Updates the payment a MercadoPago notification is about with the state
+    MercadoPago reports for it. ``status`` is the state the customer's browser
+    claims, if any. ``account_key`` names the account of the credential pool
+    the payment was made with. Returns the payment, or ``None`` if MercadoPago
+    does not know about it. Raises ``RateLimitExceeded`` if it could not ask
+    all accounts the payment may belong to.
+    """
     # Ask MercadoPago again about the status
     # to avoid pishing!
     # (don't trust any call to this url)
-    mp = Mercadopago(request.event).init_api()
-    paymentInfo = mp.get_payment(collection_id)
+    provider = Mercadopago(event)
+    for i, account in enumerate(provider.candidate_accounts(account_key)):
+        # Anyone can make us look a payment up with further accounts of the
+        # pool, so these lookups count against the accounts' rate limits.
+        if i and not provider.get_rate_limiter(account).try_acquire():
+            raise RateLimitExceeded('MercadoPago rate limit reached while looking up payment ' + str(mp_payment_id))
+        paymentInfo = provider.init_api(account).get_payment(mp_payment_id)
+        if paymentInfo["status"] == 200:
+            break
+
+    if paymentInfo["status"] != 200:
+        _report(request, _('Invalid attempt update payment details of ' + str(mp_payment_id)))
+        return None
 
+    orderid = str(paymentInfo['response']['external_reference'])
     payment = None
-    orderid = None
-    if paymentInfo["status"] == 200:
-        orderid = paymentInfo['response']['external_reference']
-        payment = OrderPayment.objects.get(pk=orderid)
-    else:
-        messages.error(request, _('Invalid attempt update payment details of ' + collection_id))
+    if orderid.isdigit():
+        payment = OrderPayment.objects.filter(pk=orderid, order__event=event).select_related('order').first()
+    if payment is None:
+        _report(request, _('Invalid attempt update payment details of ' + str(mp_payment_id)))
+        return None
+
+    # The payment has to belong to the account we just asked
+    recorded_account = payment.info_data.get('account')
+    if recorded_account and recorded_account != account.key:
+        _report(request, _('Invalid attempt to pay order ' + orderid))
         return None
 
     # Documentation for payment object:
     # https://www.mercadopago.com.ar/developers/es/reference/payments/resource/
-    if payment:
-        order = payment.order
-        mpstatus = paymentInfo['response']['status']
-
-        # Something fishy detected
-        if status != mpstatus:
-            messages.error(request, _('Invalid attempt to pay order ' + orderid))
-
-        # Update with what MercadoPago has
-        if mpstatus == 'approved':
-            payment.order.status = Order.STATUS_PAID
-            try:
-                payment.confirm()
-            except Quota.QuotaExceededException:
-                messages.error(request, _('Quota exceeded with order ' + orderid))
-        elif (mpstatus == 'pending') or (mpstatus == 'authorized') or (mpstatus == 'in_process') or (mpstatus == 'in_mediation'):
-            payment.order.status = Order.STATUS_PENDING
-            payment.state = 'pending'
-        elif (mpstatus == 'cancelled'):
-            payment.order.status = Order.STATUS_CANCELED
-            payment.fail(info={
-                'error': True,
-                'message': _('Payment Cancelled'),
-            })
-        elif (mpstatus == 'rejected'):
-            payment.order.status = Order.STATUS_CANCELED
-            payment.fail(info={
-                'error': True,
-                'message': _('Payment Rejected'),
-            })
-        elif (mpstatus == 'refunded') or (mpstatus == 'charged_back'):
-            payment.order.status = Order.STATUS_CANCELED
-            payment.state = 'refunded'
-
-        payment.info = paymentInfo['response']['status_detail']
-        payment.order.save()
-        payment.save()
-
-        return redirect(eventreverse(request.event, 'presale:event.order', kwargs={
-            'order': payment.order.code,
-            'secret': payment.order.secret
-        }) + ('?paid=yes' if payment.order.status == Order.STATUS_PAID else ''))
-    else:
-        messages.error(request, _('Invalid attempt update payment details of ' + collection_id))
-        urlkwargs['step'] = 'confirm'
-        return redirect(eventreverse(request.event, 'presale:event.checkout', kwargs=urlkwargs))
+    mpstatus = paymentInfo['response']['status']
+
+    # Keep the preference data stored when the payment was started
+    info = payment.info_data
+    info.update(
+        status_detail=paymentInfo['response']['status_detail'],
+        account=account.key,
+    )
+
+    # Something fishy detected
+    if status is not None and status != mpstatus:
+        _report(request, _('Invalid attempt to pay order ' + orderid))
+
+    # Update with what MercadoPago has
+    if mpstatus == 'approved':
+        payment.order.status = Order.STATUS_PAID
+        try:
+            payment.confirm()
+        except Quota.QuotaExceededException:
+            _report(request, _('Quota exceeded with order ' + orderid))
+    elif (mpstatus == 'pending') or (mpstatus == 'authorized') or (mpstatus == 'in_process') or (mpstatus == 'in_mediation'):
+        payment.order.status = Order.STATUS_PENDING
+        payment.state = 'pending'
+    elif (mpstatus == 'cancelled'):
+        payment.order.status = Order.STATUS_CANCELED
+        info.update(error=True, message=str(_('Payment Cancelled')))
+        payment.fail(info=info)
+    elif (mpstatus == 'rejected'):
+        payment.order.status = Order.STATUS_CANCELED
+        info.update(error=True, message=str(_('Payment Rejected')))
+        payment.fail(info=info)
+    elif (mpstatus == 'refunded') or (mpstatus == 'charged_back'):
+        payment.order.status = Order.STATUS_CANCELED
+        payment.state = 'refunded'
+
+    payment.info = json.dumps(info)
+    payment.order.save()
+    payment.save()
+    return payment
+
+
+def _customer_redirect(request, payment=None):
+    # The order page's URL contains the order's secret. Unless MercadoPago
+    # confirmed the payment, we only lead the customer back to the order
+    # they started the payment of in this session.
+    if payment is None:
+        reference = request.GET.get('external_reference', '')
+        if reference and reference == str(request.session.get('payment_mercadopago_payment')):
+            payment = OrderPayment.objects.filter(
+                pk=reference, order__event=request.event
+            ).select_related('order').first()
+    if payment is None:
+        return redirect(eventreverse(request.event, 'presale:event.index'))
+    return redirect(eventreverse(request.event, 'presale:event.order', kwargs={
+        'order': payment.order.code,
+        'secret': payment.order.secret
+    }) + ('?paid=yes' if payment.order.status == Order.STATUS_PAID else ''))
+
+
+# Return url for MercadoPago when payment is pending or success,
+# and the URL it sends its notifications to
+@csrf_exempt
+def success(request, *args, **kwargs):
+    if not hasattr(request, 'event'):
+        # We can't tell which credentials to verify the payment with
+        return HttpResponseBadRequest('Notifications need to be sent to the URL of an event')
+
+    # Journal the notification before doing anything else with it,
+    # so it can be replayed if processing fails.
+    body = request.body.decode('utf-8', errors='replace')
+    notification = WebhookEvent.objects.create(
+        event=request.event,
+        method=request.method,
+        query=json.dumps(request.GET.dict()),
+        body=body,
+    )
+    # The customer's browser coming back always ends up on a page of the
+    # shop, server notifications get a plain answer.
+    from_customer = 'collection_id' in request.GET
+
+    mp_payment_id = parse_notification(request.GET, body)
+    if mp_payment_id is None:
+        # Nothing we act upon
+        notification.record_outcome(WebhookEvent.OUTCOME_IGNORED)
+        if from_customer:
+            messages.error(request, _('The payment was not completed.'))
+            return _customer_redirect(request)
+        return HttpResponse('OK')
+
+    try:
+        payment = process_notification(
+            request.event,
+            mp_payment_id,
+            request.GET.get('collection_status'),
+            request=request,
+            account_key=request.GET.get('account')
+        )
+    except Exception:
+        # The notification stays unprocessed in the journal, and MercadoPago
+        # will try again.
+        logger.exception('Could not process MercadoPago notification %s', notification.pk)
+        if from_customer:
+            messages.error(request, _('We could not confirm your payment yet. Your order will be updated as '
+                                      'soon as MercadoPago informs us about it.'))
+            return _customer_redirect(request)
+        return HttpResponse('Could not process the notification', status=503)
+    if payment is None:
+        # process_notification already told the customer what went wrong
+        notification.record_outcome(WebhookEvent.OUTCOME_REJECTED)
+        if from_customer:
+            return _customer_redirect(request)
+        return HttpResponseBadRequest('Invalid parameter')
+
+    notification.record_outcome(WebhookEvent.OUTCOME_PROCESSED)
+    if from_customer:
+        return _customer_redirect(request, payment)
+    return HttpResponse('OK')
 
 
 @event_permission_required('can_change_event_settings')
@@ -0,0 +1,35 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Event, Order, Organizer
+
+
+@pytest.fixture
+@scopes_disabled()
+def organizer():
+    return Organizer.objects.create(name='Dummy', slug='dummy')
+
+
+@pytest.fixture
+@scopes_disabled()
+def event(organizer):
+    event = Event.objects.create(
+        organizer=organizer, name='Dummy', slug='dummy', currency='ARS',
+        date_from=now(), plugins='pretix_mercadopago'
+    )
+    event.settings.payment_mercadopago_client_id = 'event-client-id'
+    event.settings.payment_mercadopago_secret = 'event-secret'
+    return event
+
+
+@pytest.fixture
+@scopes_disabled()
+def order(event):
+    return Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('23.00'),
+    )
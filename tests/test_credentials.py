@@ -0,0 +1,183 @@
+import json
+
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+from django_scopes import scopes_disabled
+
+from pretix.base.models import OrderPayment
+from pretix_mercadopago import payment as payment_module
+from pretix_mercadopago.credentials import (
+    Account, format_pool, mark_unhealthy, parse_pool, round_robin,
+)
+from pretix_mercadopago.forms import OrganizerSettingsForm
+from pretix_mercadopago.payment import Mercadopago
+from pretix_mercadopago.ratelimit import RateLimitExceeded
+from pretix_mercadopago.views import process_notification
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache():
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        cache.clear()
+        yield
+
+
+@pytest.fixture
+def pool(organizer):
+    organizer.settings.payment_mercadopago_credential_pool = 'pool-1 secret-1\npool-2 secret-2'
+    return [Account('pool-1', 'secret-1'), Account('pool-2', 'secret-2')]
+
+
+def test_parse_pool():
+    assert parse_pool('  \nclient secret\nTOKEN\n') == [Account('client', 'secret'), Account('TOKEN', '')]
+    assert parse_pool(None) == []
+    with pytest.raises(ValueError):
+        parse_pool('client secret extra')
+
+
+def test_format_pool_roundtrip():
+    accounts = [Account('client', 'secret'), Account('TOKEN', '')]
+    assert parse_pool(format_pool(accounts)) == accounts
+
+
+def test_round_robin_rotates():
+    accounts = [Account('a', ''), Account('b', ''), Account('c', '')]
+    first = [round_robin(accounts, 'orga')[0] for i in range(3)]
+    assert sorted(first) == sorted(accounts)
+
+
+def test_round_robin_skips_unhealthy():
+    accounts = [Account('a', ''), Account('b', '')]
+    mark_unhealthy(accounts[0])
+    for i in range(3):
+        assert round_robin(accounts, 'orga') == [accounts[1]]
+
+
+def test_round_robin_all_unhealthy():
+    accounts = [Account('a', ''), Account('b', '')]
+    for a in accounts:
+        mark_unhealthy(a)
+    assert sorted(round_robin(accounts, 'orga')) == sorted(accounts)
+
+
+@pytest.mark.django_db
+def test_accounts_without_pool(event):
+    provider = Mercadopago(event)
+    assert provider.accounts == [Account('event-client-id', 'event-secret')]
+    assert provider.get_account(None) == provider.event_account
+
+
+@pytest.mark.django_db
+def test_get_account_falls_back_to_event_credentials(event, pool):
+    provider = Mercadopago(event)
+    assert provider.accounts == pool
+    assert provider.get_account(pool[1].key) == pool[1]
+    # Payments from before the pool have no key, or one of removed credentials
+    assert provider.get_account(None) == provider.event_account
+    assert provider.get_account('unknown') == provider.event_account
+    assert provider.candidate_accounts(None) == [provider.event_account] + pool
+
+
+def _fake_mp(monkeypatch, payment, asked, mp_status='pending'):
+    class FakeMP:
+        def __init__(self, client_id, secret=None):
+            self.client_id = client_id
+
+        def get_payment(self, mp_payment_id):
+            asked.append(self.client_id)
+            if self.client_id != 'pool-2':
+                return {'status': 404, 'response': {}}
+            return {'status': 200, 'response': {
+                'external_reference': str(payment.pk), 'status': mp_status, 'status_detail': 'some_detail',
+            }}
+
+    monkeypatch.setattr(payment_module.mercadopago, 'MP', FakeMP)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+@pytest.mark.parametrize('mp_status,state', [
+    ('pending', OrderPayment.PAYMENT_STATE_PENDING),
+    ('rejected', OrderPayment.PAYMENT_STATE_FAILED),
+])
+def test_notification_without_key_tries_all_accounts(event, order, pool, monkeypatch, mp_status, state):
+    p = order.payments.create(provider='pretix_mercadopago', state=OrderPayment.PAYMENT_STATE_CREATED,
+                              amount=order.total, info=json.dumps({
+                                  'account': pool[1].key,
+                                  'expiration_date_to': '2026-01-01T10:00:00+00:00',
+                                  'response': {'id': 'pref-1'},
+                              }))
+    asked = []
+    _fake_mp(monkeypatch, p, asked, mp_status)
+
+    assert process_notification(event, '99') == p
+    assert asked == ['event-client-id', 'pool-1', 'pool-2']
+    p.refresh_from_db()
+    assert p.state == state
+    # The preference data of the payment is kept
+    assert p.info_data['account'] == pool[1].key
+    assert p.info_data['status_detail'] == 'some_detail'
+    assert p.info_data['expiration_date_to'] == '2026-01-01T10:00:00+00:00'
+    assert p.info_data['response'] == {'id': 'pref-1'}
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_notification_fallback_lookups_are_rate_limited(event, order, pool, monkeypatch):
+    event.organizer.settings.payment_mercadopago_api_rate_limit = 1
+    p = order.payments.create(provider='pretix_mercadopago', state=OrderPayment.PAYMENT_STATE_CREATED,
+                              amount=order.total, info='{}')
+    asked = []
+    _fake_mp(monkeypatch, p, asked)
+    Mercadopago(event).get_rate_limiter(pool[0]).try_acquire()
+
+    with pytest.raises(RateLimitExceeded):
+        process_notification(event, '99')
+    assert asked == ['event-client-id']
+    p.refresh_from_db()
+    assert p.state == OrderPayment.PAYMENT_STATE_CREATED
+
+
+@pytest.mark.django_db
+def test_form_never_shows_secrets(organizer, pool):
+    form = OrganizerSettingsForm(organizer=organizer)
+    html = form.as_p()
+    assert 'secret-1' not in html and 'secret-2' not in html
+    assert pool[0].key in html
+
+
+@pytest.mark.django_db
+def test_form_adds_and_removes_accounts(organizer, pool):
+    form = OrganizerSettingsForm(organizer=organizer, data={
+        'add_accounts': 'pool-3 secret-3\npool-1 secret-1',
+        'remove_accounts': [pool[1].key],
+        'api_rate_limit': '5',
+        'api_rate_limit_wait': '1',
+    })
+    assert form.is_valid(), form.errors
+    form.save()
+
+    organizer.settings.flush()
+    assert parse_pool(organizer.settings.payment_mercadopago_credential_pool) == [
+        pool[0], Account('pool-3', 'secret-3')
+    ]
+    assert organizer.settings.get('payment_mercadopago_api_rate_limit', as_type=int) == 5
+
+
+@pytest.mark.django_db
+def test_form_rejects_malformed_accounts(organizer):
+    form = OrganizerSettingsForm(organizer=organizer, data={
+        'add_accounts': 'one two three', 'api_rate_limit': '5', 'api_rate_limit_wait': '1',
+    })
+    assert not form.is_valid()
+    assert 'add_accounts' in form.errors
+
+
+@pytest.mark.django_db
+def test_form_limits_waiting_time(organizer):
+    form = OrganizerSettingsForm(organizer=organizer, data={
+        'add_accounts': '', 'api_rate_limit': '5', 'api_rate_limit_wait': '60',
+    })
+    assert not form.is_valid()
+    assert 'api_rate_limit_wait' in form.errors
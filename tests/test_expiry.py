@@ -0,0 +1,86 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import OrderPayment
+from pretix_mercadopago.signals import expire_abandoned_payments
+
+
+def _payment(order, created, expiration_date_to=None, state=OrderPayment.PAYMENT_STATE_CREATED):
+    info = {}
+    if expiration_date_to:
+        info['expiration_date_to'] = expiration_date_to.isoformat()
+    p = order.payments.create(provider='pretix_mercadopago', state=state, amount=order.total, info=json.dumps(info))
+    OrderPayment.objects.filter(pk=p.pk).update(created=created)
+    return p
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_expire_after_link_expiry_and_grace(order):
+    expired = _payment(order, now() - timedelta(minutes=120), now() - timedelta(minutes=16))
+    in_grace = _payment(order, now() - timedelta(minutes=120), now() - timedelta(minutes=14))
+
+    expire_abandoned_payments(sender=None)
+
+    expired.refresh_from_db()
+    in_grace.refresh_from_db()
+    assert expired.state == OrderPayment.PAYMENT_STATE_CANCELED
+    assert in_grace.state == OrderPayment.PAYMENT_STATE_CREATED
+    assert order.all_logentries().filter(action_type='pretix.event.order.payment.canceled').count() == 1
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_retried_payment_uses_latest_link(order):
+    # Created long ago, but the customer just got a new link for it
+    p = _payment(order, now() - timedelta(minutes=70), now() + timedelta(minutes=58))
+
+    expire_abandoned_payments(sender=None)
+
+    p.refresh_from_db()
+    assert p.state == OrderPayment.PAYMENT_STATE_CREATED
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_without_link_falls_back_to_payment_creation(order):
+    old = _payment(order, now() - timedelta(minutes=76))
+    recent = _payment(order, now() - timedelta(minutes=74))
+
+    expire_abandoned_payments(sender=None)
+
+    old.refresh_from_db()
+    recent.refresh_from_db()
+    assert old.state == OrderPayment.PAYMENT_STATE_CANCELED
+    assert recent.state == OrderPayment.PAYMENT_STATE_CREATED
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_only_created_payments_expire(order):
+    p = _payment(order, now() - timedelta(minutes=120), now() - timedelta(minutes=60),
+                 state=OrderPayment.PAYMENT_STATE_PENDING)
+
+    expire_abandoned_payments(sender=None)
+
+    p.refresh_from_db()
+    assert p.state == OrderPayment.PAYMENT_STATE_PENDING
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_expire_in_bulk(order, monkeypatch):
+    monkeypatch.setattr('pretix_mercadopago.signals.EXPIRATION_BATCH_SIZE', 2)
+    payments = [_payment(order, now() - timedelta(minutes=120), now() - timedelta(minutes=60)) for i in range(5)]
+
+    expire_abandoned_payments(sender=None)
+
+    assert set(OrderPayment.objects.filter(pk__in=[p.pk for p in payments]).values_list('state', flat=True)) == {
+        OrderPayment.PAYMENT_STATE_CANCELED
+    }
+    logged = order.all_logentries().filter(action_type='pretix.event.order.payment.canceled')
+    assert sorted(json.loads(le.data)['local_id'] for le in logged) == sorted(p.local_id for p in payments)
@@ -0,0 +1,130 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix_mercadopago import views
+from pretix_mercadopago.models import WebhookEvent
+from pretix_mercadopago.signals import prune_webhook_journal
+from pretix_mercadopago.views import parse_notification
+
+
+@pytest.mark.parametrize('query,body,expected', [
+    ({'collection_id': '123', 'collection_status': 'approved'}, '', '123'),
+    ({'collection_id': 'null'}, '', None),
+    ({'topic': 'payment', 'id': '123'}, '', '123'),
+    ({'topic': 'merchant_order', 'id': '456'}, '', None),
+    ({'type': 'payment', 'data.id': '123'}, '', '123'),
+    ({}, json.dumps({'type': 'payment', 'data': {'id': 123}}), '123'),
+    ({}, json.dumps({'type': 'plan', 'data': {'id': 123}}), None),
+    ({}, 'garbage', None),
+])
+def test_parse_notification(query, body, expected):
+    assert parse_notification(query, body) == expected
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_replay_dry_run(event):
+    n1 = WebhookEvent.objects.create(event=event, method='POST', query=json.dumps({'topic': 'payment', 'id': '123'}))
+    WebhookEvent.objects.create(event=event, method='POST', query=json.dumps({'topic': 'merchant_order', 'id': '4'}))
+
+    out = StringIO()
+    call_command('mercadopago_replay_webhooks', dry_run=True, stdout=out)
+
+    assert '{} '.format(n1.pk) in out.getvalue()
+    assert 'Would replay 1 notifications, 1 ignored.' in out.getvalue()
+    n1.refresh_from_db()
+    assert n1.processed is None
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_prune_journal(event):
+    old_processed = WebhookEvent.objects.create(event=event, method='POST', query='{}', processed=now())
+    old_unprocessed = WebhookEvent.objects.create(event=event, method='POST', query='{}')
+    older_unprocessed = WebhookEvent.objects.create(event=event, method='POST', query='{}')
+    recent_processed = WebhookEvent.objects.create(event=event, method='POST', query='{}', processed=now())
+    WebhookEvent.objects.filter(pk=old_unprocessed.pk).update(received=now() - timedelta(days=6))
+    WebhookEvent.objects.filter(pk__in=[old_processed.pk, older_unprocessed.pk]).update(
+        received=now() - timedelta(days=31)
+    )
+
+    prune_webhook_journal(sender=None)
+
+    assert set(WebhookEvent.objects.values_list('pk', flat=True)) == {old_unprocessed.pk, recent_processed.pk}
+
+
+@pytest.fixture
+def live_event(event):
+    event.live = True
+    event.save()
+    return event
+
+
+def _stub_processing(monkeypatch, result):
+    def process(*args, **kwargs):
+        if isinstance(result, Exception):
+            raise result
+        return result
+    monkeypatch.setattr(views, 'process_notification', process)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('result,status,outcome', [
+    (None, 400, WebhookEvent.OUTCOME_REJECTED),
+    (ValueError('MercadoPago is down'), 503, ''),
+])
+def test_server_notification_outcome(client, live_event, monkeypatch, result, status, outcome):
+    _stub_processing(monkeypatch, result)
+
+    response = client.post('/dummy/dummy/mercadopago/return/?topic=payment&id=123')
+
+    assert response.status_code == status
+    notification = WebhookEvent.objects.get()
+    assert notification.outcome == outcome
+    assert (notification.processed is None) == (outcome == '')
+
+
+@pytest.mark.django_db
+def test_ignored_notification(client, live_event):
+    response = client.post('/dummy/dummy/mercadopago/return/?topic=merchant_order&id=4')
+
+    assert response.status_code == 200
+    assert WebhookEvent.objects.get().outcome == WebhookEvent.OUTCOME_IGNORED
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query,result', [
+    ('collection_id=null', None),
+    ('collection_id=123', None),
+    ('collection_id=123', ValueError('MercadoPago is down')),
+])
+def test_customer_is_always_redirected(client, live_event, monkeypatch, query, result):
+    _stub_processing(monkeypatch, result)
+
+    response = client.get('/dummy/dummy/mercadopago/return/?' + query)
+
+    assert response.status_code == 302
+    assert response['Location'].endswith('/dummy/dummy/')
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_customer_is_redirected_to_own_order_only(client, live_event, order, monkeypatch):
+    _stub_processing(monkeypatch, None)
+    payment = order.payments.create(provider='pretix_mercadopago', amount=order.total)
+    other = order.payments.create(provider='pretix_mercadopago', amount=order.total)
+    session = client.session
+    session['payment_mercadopago_payment'] = payment.pk
+    session.save()
+
+    response = client.get('/dummy/dummy/mercadopago/return/?collection_id=null&external_reference={}'.format(other.pk))
+    assert response['Location'].endswith('/dummy/dummy/')
+
+    response = client.get('/dummy/dummy/mercadopago/return/?collection_id=null&external_reference={}'.format(payment.pk))
+    assert order.secret in response['Location']
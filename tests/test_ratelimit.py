@@ -0,0 +1,94 @@
+import pytest
+from django.core.cache import cache
+from django.test import override_settings
+
+from pretix_mercadopago import ratelimit
+from pretix_mercadopago.ratelimit import WindowRateLimiter, credential_key
+
+
+class FakeClock:
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock(1000.25)
+    monkeypatch.setattr(ratelimit.time, 'time', c.time)
+    monkeypatch.setattr(ratelimit.time, 'monotonic', c.time)
+    monkeypatch.setattr(ratelimit.time, 'sleep', c.sleep)
+    return c
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache():
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        cache.clear()
+        yield
+
+
+def test_credential_key_hides_credentials():
+    assert credential_key('APP_USR-1234') == credential_key('APP_USR-1234')
+    assert credential_key('APP_USR-1234') != credential_key('APP_USR-5678')
+    assert 'APP_USR' not in credential_key('APP_USR-1234')
+
+
+def test_rate_per_second(clock):
+    limiter = WindowRateLimiter('acc', 2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+    # Still within a second of the first calls
+    clock.now = 1001.0
+    assert not limiter.try_acquire()
+
+    clock.now = 1001.3
+    assert limiter.try_acquire()
+
+
+def test_no_burst_across_seconds(clock):
+    limiter = WindowRateLimiter('acc', 2)
+    clock.now = 1000.95
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+
+    clock.now = 1001.05
+    assert not limiter.try_acquire()
+    clock.now = 1001.95
+    assert not limiter.try_acquire()
+    clock.now = 1002.05
+    assert limiter.try_acquire()
+
+
+def test_windows_are_per_account(clock):
+    assert WindowRateLimiter('a', 1).try_acquire()
+    assert not WindowRateLimiter('a', 1).try_acquire()
+    assert WindowRateLimiter('b', 1).try_acquire()
+
+
+def test_acquire_waits_for_free_slot(clock):
+    limiter = WindowRateLimiter('acc', 1)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=1)
+    assert limiter.acquire(timeout=1.1)
+    assert 1001.3 <= clock.now < 1001.4
+
+
+def test_acquire_gives_up_after_timeout(clock):
+    limiter = WindowRateLimiter('acc', 1)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0.5)
+    assert clock.now == 1000.25
+
+
+def test_no_limit(clock):
+    limiter = WindowRateLimiter('acc', 0)
+    for i in range(100):
+        assert limiter.try_acquire()
@@ -0,0 +1,39 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import OrderPayment
+from pretix_mercadopago.models import WebhookEvent
+from pretix_mercadopago.stats import _compute_payment_stats
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_compute_payment_stats(event, order):
+    for state, age in ((OrderPayment.PAYMENT_STATE_CONFIRMED, timedelta(0)),
+                       (OrderPayment.PAYMENT_STATE_CONFIRMED, timedelta(0)),
+                       (OrderPayment.PAYMENT_STATE_CREATED, timedelta(minutes=10)),
+                       (OrderPayment.PAYMENT_STATE_PENDING, timedelta(days=3))):
+        p = order.payments.create(provider='pretix_mercadopago', state=state, amount=Decimal('10.00'), info='{}')
+        OrderPayment.objects.filter(pk=p.pk).update(created=now() - age)
+    order.payments.create(provider='manual', state=OrderPayment.PAYMENT_STATE_CREATED, amount=Decimal('10.00'))
+
+    recent = WebhookEvent.objects.create(event=event, method='POST', query=json.dumps({}))
+    old = WebhookEvent.objects.create(event=event, method='POST', query=json.dumps({}))
+    WebhookEvent.objects.filter(pk=old.pk).update(received=now() - timedelta(days=2))
+    WebhookEvent.objects.create(event=event, method='POST', query=json.dumps({}), processed=now())
+
+    stats = _compute_payment_stats(event)
+
+    assert {row['state']: (row['count'], row['amount']) for row in stats['states']} == {
+        'confirmed': (2, Decimal('20.00')),
+        'created': (1, Decimal('10.00')),
+        'pending': (1, Decimal('10.00')),
+    }
+    assert stats['pending_age'] == {'less_than_1h': 1, 'from_1h_to_1d': 0, 'from_1d_to_7d': 1, 'more_than_7d': 0}
+    recent.refresh_from_db()
+    assert stats['webhook_backlog'] == {'count': 1, 'oldest': recent.received}